@@ -12,11 +12,27 @@ class Settings:
     # API Keys
     OPENAI_API_KEY: str = os.getenv("OPENAI_API_KEY")
     
+    # CORS (comma-separated origins; Starlette disables the "*" wildcard
+    # when credentials are allowed, so an explicit allowlist is required)
+    # Entries are stripped so "http://a.com, http://b.com" (and trailing
+    # commas) parse to origins that actually match the Origin header
+    ALLOWED_ORIGINS: list = [
+        origin.strip()
+        for origin in os.getenv(
+            "ALLOWED_ORIGINS", "http://localhost:8000,http://127.0.0.1:8000"
+        ).split(",")
+        if origin.strip()
+    ]
+
     # Database
     CHROMA_PERSIST_DIRECTORY: str = "./chroma_db"
+    DOCUMENT_INDEX_DB: str = "./document_index.db"
     
     # File Upload
     UPLOAD_DIRECTORY: str = "./uploads"
+    # Worker processes for batch text extraction; leave one core free by
+    # default, overridable for slow (e.g. rotating) disks
+    INGEST_WORKERS: int = int(os.getenv("INGEST_WORKERS", max(1, (os.cpu_count() or 2) - 1)))
     MAX_FILE_SIZE: int = 10 * 1024 * 1024  # 10MB
     ALLOWED_EXTENSIONS: set = {".pdf", ".txt", ".docx", ".xlsx", ".csv"}
     
@@ -24,15 +40,45 @@ class Settings:
     CHUNK_SIZE: int = 1000
     CHUNK_OVERLAP: int = 200
     TOP_K_RESULTS: int = 5
+
+    # HNSW Index Settings (applied on collection creation; Chroma's
+    # defaults of M=16/construction_ef=100/search_ef=10 trade away recall
+    # and QPS at the collection sizes a document KB reaches)
+    HNSW_M: int = 24
+    HNSW_CONSTRUCTION_EF: int = 128
+    HNSW_SEARCH_EF: int = 64
+    HNSW_BATCH_SIZE: int = 5000       # items buffered before hitting the index
+    HNSW_SYNC_THRESHOLD: int = 100000  # items between index flushes to disk
     
     # Model Settings
     EMBEDDING_MODEL: str = "all-MiniLM-L6-v2"
+    EMBEDDING_BATCH_SIZE: int = 64  # per-encode minibatch; lower on small CPUs
+    # "int8" snaps stored embeddings to the int8 grid (4x fewer
+    # meaningful bits per component, <1% recall loss on cosine search);
+    # "float32" stores them as-is
+    EMBEDDING_PRECISION: str = os.getenv("EMBEDDING_PRECISION", "float32")
     LLM_MODEL: str = "gpt-3.5-turbo"
     LLM_TEMPERATURE: float = 0.1
+    MAX_CONTEXT_TOKENS: int = 6000  # prompt-context budget per request
     
+    # Semantic Query Cache (cosine similarity between query embeddings;
+    # near-identical rephrasings reuse the full pipeline result)
+    SEMANTIC_CACHE_THRESHOLD: float = 0.92
+    SEMANTIC_CACHE_TTL: int = 300  # seconds
+    SEMANTIC_CACHE_SIZE: int = 256
+
+    # Exact Response Cache (byte-identical replay for exact-repeat
+    # queries; entries are serialized responses, so the cap is cheap)
+    EXACT_CACHE_SIZE: int = 1024
+
     # Confidence Thresholds
     HIGH_CONFIDENCE_THRESHOLD: float = 0.8
     MEDIUM_CONFIDENCE_THRESHOLD: float = 0.6
     LOW_CONFIDENCE_THRESHOLD: float = 0.4
 
+    # Completeness Bypass (skip the second LLM call when the answer is
+    # already high-confidence over strong matches, or the query is short)
+    COMPLETENESS_BYPASS_SIMILARITY: float = 0.75
+    COMPLETENESS_BYPASS_QUERY_WORDS: int = 6
+
 settings = Settings()
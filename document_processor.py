@@ -1,24 +1,107 @@
+import csv
+import functools
 import os
+import sqlite3
 import uuid
 from typing import List, Dict, Any, Optional
 from datetime import datetime
-import PyPDF2
+import fitz  # PyMuPDF
 import docx
-import pandas as pd
+import numpy as np
 from openpyxl import load_workbook
 import chromadb
 from chromadb.config import Settings as ChromaSettings
-from sentence_transformers import SentenceTransformer
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain.schema import Document
 import json
 
 from config import settings
+from embeddings import get_model, quantize_embeddings
 from models import DocumentMetadata
 
+# Extraction helpers live at module level so they are picklable and can be
+# farmed out to a worker process pool for parallel ingestion
+
+def _extract_pdf_text(file_path: str) -> str:
+    with fitz.open(file_path) as doc:
+        return "\n".join(page.get_text("text") for page in doc)
+
+def _extract_txt_text(file_path: str) -> str:
+    with open(file_path, 'r', encoding='utf-8') as file:
+        return file.read()
+
+def _extract_docx_text(file_path: str) -> str:
+    doc = docx.Document(file_path)
+    return "\n".join(paragraph.text for paragraph in doc.paragraphs)
+
+def _extract_excel_text(file_path: str) -> str:
+    # read_only avoids materializing styles/formulas for every cell;
+    # data_only returns computed values instead of formula strings
+    workbook = load_workbook(file_path, read_only=True, data_only=True)
+    parts = []
+    for sheet_name in workbook.sheetnames:
+        sheet = workbook[sheet_name]
+        parts.append(f"Sheet: {sheet_name}")
+        parts.extend(
+            " ".join("" if cell is None else str(cell) for cell in row)
+            for row in sheet.iter_rows(values_only=True)
+        )
+    return "\n".join(parts)
+
+def _extract_csv_text(file_path: str) -> str:
+    # A CSV is already text; stream rows with the stdlib reader instead
+    # of materializing a DataFrame and pretty-printing it with to_string
+    with open(file_path, newline="", encoding="utf-8", errors="replace") as file:
+        return "\n".join(" ".join(row) for row in csv.reader(file))
+
+@functools.lru_cache(maxsize=2048)
+def _embed_query_cached(model_name: str, query: str) -> bytes:
+    """Embed a query, caching the raw float32 buffer for repeat queries
+
+    Repeated identical queries (retries, pagination, shared links) skip
+    the transformer forward pass entirely. Keyed by model name so a
+    config change can't serve stale vectors, and callers normalize the
+    query text to raise the hit rate. Returns bytes because numpy
+    arrays aren't hashable cache values worth mutating in place.
+    """
+    embedding = get_model().encode([query], convert_to_numpy=True)
+    return np.asarray(embedding, dtype=np.float32).tobytes()
+
+_EXTRACTORS = {
+    "application/pdf": _extract_pdf_text,
+    "text/plain": _extract_txt_text,
+    "application/vnd.openxmlformats-officedocument.wordprocessingml.document": _extract_docx_text,
+    "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet": _extract_excel_text,
+    "application/vnd.ms-excel": _extract_excel_text,
+    "text/csv": _extract_csv_text,
+}
+
+# Fallback when the browser sends a generic content type such as
+# application/octet-stream (common for xlsx uploads)
+_EXTENSION_CONTENT_TYPES = {
+    ".pdf": "application/pdf",
+    ".txt": "text/plain",
+    ".docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+    ".xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    ".csv": "text/csv",
+}
+
+def extract_text(file_path: str, content_type: str) -> str:
+    """Extract text from various file formats"""
+    try:
+        extractor = _EXTRACTORS.get(content_type)
+        if extractor is None:
+            extension = os.path.splitext(file_path)[1].lower()
+            extractor = _EXTRACTORS.get(_EXTENSION_CONTENT_TYPES.get(extension))
+        if extractor is None:
+            raise ValueError(f"Unsupported file type: {content_type}")
+        return extractor(file_path)
+    except Exception as e:
+        raise Exception(f"Error extracting text from {file_path}: {str(e)}")
+
 class DocumentProcessor:
     def __init__(self):
-        self.embedding_model = SentenceTransformer(settings.EMBEDDING_MODEL)
+        self.embedding_model = get_model()
         self.text_splitter = RecursiveCharacterTextSplitter(
             chunk_size=settings.CHUNK_SIZE,
             chunk_overlap=settings.CHUNK_OVERLAP
@@ -33,68 +116,99 @@ class DocumentProcessor:
         # Create or get collection
         self.collection = self.chroma_client.get_or_create_collection(
             name="knowledge_base",
-            metadata={"hnsw:space": "cosine"}
+            metadata={
+                "hnsw:space": "cosine",
+                "hnsw:M": settings.HNSW_M,
+                "hnsw:construction_ef": settings.HNSW_CONSTRUCTION_EF,
+                "hnsw:search_ef": settings.HNSW_SEARCH_EF,
+                "hnsw:batch_size": settings.HNSW_BATCH_SIZE,
+                "hnsw:sync_threshold": settings.HNSW_SYNC_THRESHOLD
+            }
         )
         
         # Ensure upload directory exists
         os.makedirs(settings.UPLOAD_DIRECTORY, exist_ok=True)
 
+        # Small SQLite index mapping filenames to chunk ids, so listing
+        # and deleting documents doesn't pull every chunk's metadata out
+        # of ChromaDB into Python (O(N) scans over the whole collection)
+        self.index_db = sqlite3.connect(settings.DOCUMENT_INDEX_DB, check_same_thread=False)
+        self.index_db.executescript("""
+            CREATE TABLE IF NOT EXISTS documents (
+                filename TEXT PRIMARY KEY,
+                upload_date TEXT,
+                content_type TEXT,
+                file_size INTEGER,
+                chunk_count INTEGER
+            );
+            CREATE TABLE IF NOT EXISTS chunks (
+                chunk_id TEXT PRIMARY KEY,
+                filename TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_chunks_filename ON chunks(filename);
+        """)
+
+        # Deployments that predate the index already have chunks in the
+        # persisted collection; backfill once from their metadata so
+        # existing documents stay listable and deletable
+        if self.index_db.execute("SELECT COUNT(*) FROM documents").fetchone()[0] == 0:
+            self._backfill_index()
+
+    def _backfill_index(self):
+        """Populate the SQLite index from the persisted collection
+
+        One full metadata scan, paid only on the first startup with an
+        empty index. file_size was never stored in chunk metadata, so
+        backfilled documents report 0 just as the old scan did.
+        """
+        all_docs = self.collection.get(include=["metadatas"])
+
+        documents = {}
+        chunk_rows = []
+        for chunk_id, metadata in zip(all_docs["ids"], all_docs["metadatas"]):
+            filename = metadata.get("filename")
+            if filename is None:
+                continue
+            chunk_rows.append((chunk_id, filename))
+            row = documents.get(filename)
+            if row is None:
+                documents[filename] = [
+                    filename,
+                    metadata.get("upload_date", ""),
+                    metadata.get("content_type", ""),
+                    0,  # file_size
+                    1   # chunk_count
+                ]
+            else:
+                row[4] += 1
+
+        if documents:
+            with self.index_db:
+                self.index_db.executemany(
+                    "INSERT OR REPLACE INTO documents VALUES (?, ?, ?, ?, ?)",
+                    [tuple(row) for row in documents.values()]
+                )
+                self.index_db.executemany(
+                    "INSERT OR REPLACE INTO chunks VALUES (?, ?)",
+                    chunk_rows
+                )
+
     def extract_text_from_file(self, file_path: str, content_type: str) -> str:
         """Extract text from various file formats"""
+        return extract_text(file_path, content_type)
+
+    def process_document(self, file_path: str, filename: str, content_type: str, text: Optional[str] = None, file_size: Optional[int] = None) -> DocumentMetadata:
+        """Process and store a document in the knowledge base
+
+        Pass `text` when it was already extracted elsewhere (e.g. in a
+        worker pool during batch ingestion) to skip re-parsing the file,
+        and `file_size` when the caller already knows it (uploads do,
+        from the request) to skip a stat() on the written file.
+        """
         try:
-            if content_type == "application/pdf":
-                return self._extract_pdf_text(file_path)
-            elif content_type == "text/plain":
-                return self._extract_txt_text(file_path)
-            elif content_type == "application/vnd.openxmlformats-officedocument.wordprocessingml.document":
-                return self._extract_docx_text(file_path)
-            elif content_type in ["application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", "application/vnd.ms-excel"]:
-                return self._extract_excel_text(file_path)
-            elif content_type == "text/csv":
-                return self._extract_csv_text(file_path)
-            else:
-                raise ValueError(f"Unsupported file type: {content_type}")
-        except Exception as e:
-            raise Exception(f"Error extracting text from {file_path}: {str(e)}")
-
-    def _extract_pdf_text(self, file_path: str) -> str:
-        text = ""
-        with open(file_path, 'rb') as file:
-            pdf_reader = PyPDF2.PdfReader(file)
-            for page in pdf_reader.pages:
-                text += page.extract_text() + "\n"
-        return text
-
-    def _extract_txt_text(self, file_path: str) -> str:
-        with open(file_path, 'r', encoding='utf-8') as file:
-            return file.read()
-
-    def _extract_docx_text(self, file_path: str) -> str:
-        doc = docx.Document(file_path)
-        text = ""
-        for paragraph in doc.paragraphs:
-            text += paragraph.text + "\n"
-        return text
-
-    def _extract_excel_text(self, file_path: str) -> str:
-        workbook = load_workbook(file_path)
-        text = ""
-        for sheet_name in workbook.sheetnames:
-            sheet = workbook[sheet_name]
-            text += f"Sheet: {sheet_name}\n"
-            for row in sheet.iter_rows(values_only=True):
-                text += " ".join([str(cell) if cell is not None else "" for cell in row]) + "\n"
-        return text
-
-    def _extract_csv_text(self, file_path: str) -> str:
-        df = pd.read_csv(file_path)
-        return df.to_string()
-
-    def process_document(self, file_path: str, filename: str, content_type: str) -> DocumentMetadata:
-        """Process and store a document in the knowledge base"""
-        try:
-            # Extract text
-            text = self.extract_text_from_file(file_path, content_type)
+            # Extract text unless the caller already did
+            if text is None:
+                text = self.extract_text_from_file(file_path, content_type)
             
             if not text.strip():
                 raise ValueError("No text content found in the document")
@@ -102,11 +216,24 @@ class DocumentProcessor:
             # Split into chunks
             documents = self.text_splitter.split_text(text)
             
-            # Create document ID
+            # Create document ID and a single upload timestamp shared by
+            # every chunk (one datetime.now() instead of one per chunk)
             doc_id = str(uuid.uuid4())
+            upload_date = datetime.now().isoformat()
             
-            # Generate embeddings and store in ChromaDB
-            embeddings = self.embedding_model.encode(documents).tolist()
+            # Generate embeddings and store in ChromaDB. The model sorts
+            # inputs by length internally, so batching pads each minibatch
+            # only to its longest member; normalizing here lets the cosine
+            # collection skip an extra pass.
+            embeddings = self.embedding_model.encode(
+                documents,
+                batch_size=settings.EMBEDDING_BATCH_SIZE,
+                show_progress_bar=False,
+                convert_to_numpy=True,
+                normalize_embeddings=True
+            )
+            if settings.EMBEDDING_PRECISION == "int8":
+                embeddings = quantize_embeddings(embeddings)
             
             # Prepare metadata for each chunk
             metadatas = []
@@ -118,27 +245,45 @@ class DocumentProcessor:
                     "filename": filename,
                     "chunk_index": i,
                     "total_chunks": len(documents),
-                    "upload_date": datetime.now().isoformat(),
-                    "content_type": content_type
+                    "upload_date": upload_date,
+                    "content_type": content_type,
+                    # prebuilt once here so the per-query context loop
+                    # and source formatting only read ready-made strings
+                    "source_label": f"Source: {filename}",
+                    "preview": (doc[:200] + "...") if len(doc) > 200 else doc
                 }
                 
                 metadatas.append(metadata)
                 ids.append(chunk_id)
             
-            # Store in ChromaDB
+            # Store in ChromaDB; the pinned 0.4.x client validates
+            # embeddings as plain lists, so the numpy batch is unboxed
+            # only here at the call boundary
             self.collection.add(
-                embeddings=embeddings,
+                embeddings=embeddings.tolist(),
                 documents=documents,
                 metadatas=metadatas,
                 ids=ids
             )
             
-            # Get file size
-            file_size = os.path.getsize(file_path)
-            
+            # Get file size if the caller didn't supply it
+            if file_size is None:
+                file_size = os.path.getsize(file_path)
+
+            # Record the document and its chunk ids in the SQLite index
+            with self.index_db:
+                self.index_db.execute(
+                    "INSERT OR REPLACE INTO documents VALUES (?, ?, ?, ?, ?)",
+                    (filename, upload_date, content_type, file_size, len(documents))
+                )
+                self.index_db.executemany(
+                    "INSERT OR REPLACE INTO chunks VALUES (?, ?)",
+                    [(chunk_id, filename) for chunk_id in ids]
+                )
+
             return DocumentMetadata(
                 filename=filename,
-                upload_date=datetime.now().isoformat(),
+                upload_date=upload_date,
                 file_size=file_size,
                 content_type=content_type,
                 chunk_count=len(documents),
@@ -155,14 +300,121 @@ class DocumentProcessor:
                 processing_status=f"error: {str(e)}"
             )
 
+    def process_documents(self, items: List[tuple]) -> List[DocumentMetadata]:
+        """Process several pre-extracted documents with one ChromaDB write
+
+        Each item is (file_path, filename, content_type, text,
+        file_size). Chunks from all files are embedded together and
+        added in a single collection.add call, so the index WAL syncs
+        once per batch instead of once per document.
+        """
+        results = []
+        batch_chunks = []
+        batch_metadatas = []
+        batch_ids = []
+        pending = []  # (result index, filename, content_type, file_size, chunk_count, upload_date)
+
+        for file_path, filename, content_type, text, file_size in items:
+            upload_date = datetime.now().isoformat()
+            try:
+                if not text.strip():
+                    raise ValueError("No text content found in the document")
+
+                documents = self.text_splitter.split_text(text)
+                doc_id = str(uuid.uuid4())
+
+                for i, chunk in enumerate(documents):
+                    batch_chunks.append(chunk)
+                    batch_ids.append(f"{doc_id}_chunk_{i}")
+                    batch_metadatas.append({
+                        "filename": filename,
+                        "chunk_index": i,
+                        "total_chunks": len(documents),
+                        "upload_date": upload_date,
+                        "content_type": content_type,
+                        "source_label": f"Source: {filename}",
+                        "preview": (chunk[:200] + "...") if len(chunk) > 200 else chunk
+                    })
+
+                if file_size is None:
+                    file_size = os.path.getsize(file_path)
+                pending.append((len(results), filename, content_type, file_size, len(documents), upload_date))
+                results.append(None)  # filled in after the batch write
+
+            except Exception as e:
+                results.append(DocumentMetadata(
+                    filename=filename,
+                    upload_date=upload_date,
+                    file_size=0,
+                    content_type=content_type,
+                    chunk_count=0,
+                    processing_status=f"error: {str(e)}"
+                ))
+
+        if batch_chunks:
+            try:
+                embeddings = self.embedding_model.encode(
+                    batch_chunks,
+                    batch_size=settings.EMBEDDING_BATCH_SIZE,
+                    show_progress_bar=False,
+                    convert_to_numpy=True,
+                    normalize_embeddings=True
+                )
+                if settings.EMBEDDING_PRECISION == "int8":
+                    embeddings = quantize_embeddings(embeddings)
+
+                self.collection.add(
+                    embeddings=embeddings.tolist(),
+                    documents=batch_chunks,
+                    metadatas=batch_metadatas,
+                    ids=batch_ids
+                )
+
+                with self.index_db:
+                    self.index_db.executemany(
+                        "INSERT OR REPLACE INTO documents VALUES (?, ?, ?, ?, ?)",
+                        [(p[1], p[5], p[2], p[3], p[4]) for p in pending]
+                    )
+                    self.index_db.executemany(
+                        "INSERT OR REPLACE INTO chunks VALUES (?, ?)",
+                        [(chunk_id, metadata["filename"]) for chunk_id, metadata in zip(batch_ids, batch_metadatas)]
+                    )
+
+                status = "completed"
+            except Exception as e:
+                status = f"error: {str(e)}"
+
+            for index, filename, content_type, file_size, chunk_count, upload_date in pending:
+                results[index] = DocumentMetadata(
+                    filename=filename,
+                    upload_date=upload_date,
+                    file_size=file_size if status == "completed" else 0,
+                    content_type=content_type,
+                    chunk_count=chunk_count if status == "completed" else 0,
+                    processing_status=status
+                )
+
+        return results
+
+    def embed_query(self, query: str) -> np.ndarray:
+        """Embed a query string, sharing the repeat-query cache"""
+        # all-MiniLM is uncased, so lowercasing folds case variants onto
+        # one cache entry without changing the embedding
+        return np.frombuffer(
+            _embed_query_cached(settings.EMBEDDING_MODEL, query.strip().lower()),
+            dtype=np.float32
+        )
+
     def search_documents(self, query: str, top_k: int = None) -> List[Dict[str, Any]]:
         """Search for relevant document chunks"""
         if top_k is None:
             top_k = settings.TOP_K_RESULTS
-            
-        # Generate query embedding
-        query_embedding = self.embedding_model.encode([query]).tolist()[0]
-        
+
+        # Generate query embedding (cached for repeat queries); the
+        # numpy math stays upstream, with .tolist() only at the call
+        # boundary because chromadb 0.4.x validates against plain lists
+        query_embedding = self.embed_query(query).tolist()
+
         # Search in ChromaDB
         results = self.collection.query(
             query_embeddings=[query_embedding],
@@ -170,58 +422,61 @@ class DocumentProcessor:
             include=["documents", "metadatas", "distances"]
         )
         
-        # Format results
-        formatted_results = []
-        for i in range(len(results["documents"][0])):
-            formatted_results.append({
-                "content": results["documents"][0][i],
-                "metadata": results["metadatas"][0][i],
-                "similarity_score": 1 - results["distances"][0][i],  # Convert distance to similarity
-                "chunk_id": results["ids"][0][i]
-            })
-        
-        return formatted_results
+        # Format results; convert distances to similarities in one
+        # vectorized pass and zip the parallel lists instead of indexing
+        # into each of them per result
+        docs = results["documents"][0]
+        metadatas = results["metadatas"][0]
+        ids = results["ids"][0]
+        similarities = (1.0 - np.asarray(results["distances"][0], dtype=np.float32)).tolist()
+
+        return [
+            {
+                "content": content,
+                "metadata": metadata,
+                "similarity_score": similarity,
+                "chunk_id": chunk_id
+            }
+            for content, metadata, similarity, chunk_id in zip(docs, metadatas, similarities, ids)
+        ]
 
     def get_document_list(self) -> List[DocumentMetadata]:
         """Get list of all processed documents"""
-        # This is a simplified version - in production, you'd want to maintain a separate metadata store
         try:
-            # Get all documents from ChromaDB
-            all_docs = self.collection.get(include=["metadatas"])
-            
-            # Group by filename and create metadata
-            doc_metadata = {}
-            for i, metadata in enumerate(all_docs["metadatas"]):
-                filename = metadata["filename"]
-                if filename not in doc_metadata:
-                    doc_metadata[filename] = DocumentMetadata(
-                        filename=filename,
-                        upload_date=metadata["upload_date"],
-                        content_type=metadata["content_type"],
-                        chunk_count=0,
-                        file_size=0,  # We don't store this in ChromaDB
-                        processing_status="completed"
-                    )
-                doc_metadata[filename].chunk_count += 1
-            
-            return list(doc_metadata.values())
+            rows = self.index_db.execute(
+                "SELECT filename, upload_date, content_type, file_size, chunk_count FROM documents"
+            ).fetchall()
+
+            return [
+                DocumentMetadata(
+                    filename=row[0],
+                    upload_date=row[1],
+                    content_type=row[2],
+                    file_size=row[3],
+                    chunk_count=row[4],
+                    processing_status="completed"
+                )
+                for row in rows
+            ]
         except Exception as e:
             return []
 
     def delete_document(self, filename: str) -> bool:
         """Delete a document and all its chunks from the knowledge base"""
         try:
-            # Get all chunks for this document
-            all_docs = self.collection.get(include=["metadatas", "ids"])
-            
-            chunk_ids_to_delete = []
-            for i, metadata in enumerate(all_docs["metadatas"]):
-                if metadata["filename"] == filename:
-                    chunk_ids_to_delete.append(all_docs["ids"][i])
-            
-            if chunk_ids_to_delete:
-                self.collection.delete(ids=chunk_ids_to_delete)
-                return True
-            return False
+            row = self.index_db.execute(
+                "SELECT 1 FROM documents WHERE filename = ?", (filename,)
+            ).fetchone()
+
+            if row is None:
+                return False
+
+            # Chroma evaluates the where filter in its own backend, so no
+            # chunk ids ever cross into Python
+            self.collection.delete(where={"filename": filename})
+            with self.index_db:
+                self.index_db.execute("DELETE FROM chunks WHERE filename = ?", (filename,))
+                self.index_db.execute("DELETE FROM documents WHERE filename = ?", (filename,))
+            return True
         except Exception as e:
             return False
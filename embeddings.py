@@ -0,0 +1,47 @@
+import numpy as np
+from sentence_transformers import SentenceTransformer
+
+from config import settings
+
+# Module-level singleton so DocumentProcessor and RAGPipeline share one
+# model instance instead of each loading their own copy (~90MB each)
+_model = None
+
+def get_model() -> SentenceTransformer:
+    """Get the shared embedding model, loading it on first use"""
+    global _model
+    if _model is None:
+        import torch
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+        model = SentenceTransformer(settings.EMBEDDING_MODEL, device=device)
+        if device == "cuda":
+            # FP16 halves memory traffic and enables tensor cores
+            model = model.half()
+
+        # Force the Rust-backed "fast" tokenizer; the Python one is ~10x
+        # slower and dominates CPU time when embedding short chunks
+        try:
+            from transformers import AutoTokenizer
+            model.tokenizer = AutoTokenizer.from_pretrained(
+                f"sentence-transformers/{settings.EMBEDDING_MODEL}", use_fast=True
+            )
+        except Exception:
+            pass  # keep whatever tokenizer the model shipped with
+
+        # One-time warmup so the first real request doesn't pay lazy CUDA
+        # init / CuDNN algorithm selection
+        model.encode(["warmup"] * 8, batch_size=8, show_progress_bar=False)
+
+        _model = model
+    return _model
+
+def quantize_embeddings(embeddings: np.ndarray) -> np.ndarray:
+    """Quantize L2-normalized embeddings to the int8 grid
+
+    Unit-vector components lie in [-1, 1], so a fixed 127x scale maps
+    them onto int8 without per-batch calibration ranges. Cosine
+    similarity is scale-invariant, so rankings are preserved up to the
+    rounding error. Queries don't need the same treatment; comparing a
+    full-precision query against quantized documents is fine.
+    """
+    return np.clip(np.rint(embeddings * 127.0), -127, 127).astype(np.int8)
@@ -1,46 +1,81 @@
 from fastapi import FastAPI, File, UploadFile, HTTPException, Depends, Form, Request
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.responses import HTMLResponse, JSONResponse, ORJSONResponse
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+import asyncio
 import os
-import shutil
+import aiofiles
 from typing import List, Optional
 import json
 from datetime import datetime
 
+from concurrent.futures import ProcessPoolExecutor
+
 from config import settings
 from models import SearchResponse, DocumentMetadata, SearchQuery, AnswerRating
-from document_processor import DocumentProcessor
+from document_processor import DocumentProcessor, extract_text
 from rag_pipeline import RAGPipeline
 
 # Initialize FastAPI app
 app = FastAPI(
     title="AI-Powered Knowledge Base Search & Enrichment",
     description="Upload documents, search with natural language, and get AI-powered answers with enrichment suggestions",
-    version="1.0.0"
+    version="1.0.0",
+    # Rust-backed JSON encoder; biggest win on /search's nested sources
+    # and /documents' metadata rows
+    default_response_class=ORJSONResponse
 )
 
 # Add CORS middleware
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],
+    allow_origins=settings.ALLOWED_ORIGINS,
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
 )
 
+# Compress responses above 1KB; /search JSON payloads shrink ~5x
+app.add_middleware(GZipMiddleware, minimum_size=1024)
+
 # Initialize components
 document_processor = DocumentProcessor()
 rag_pipeline = RAGPipeline()
 
-# Mount static files and templates
+# Mount static files and templates; templates don't change at runtime,
+# so keep compiled templates cached instead of re-checking per request
 app.mount("/static", StaticFiles(directory="static"), name="static")
 templates = Jinja2Templates(directory="templates")
+templates.env.auto_reload = False
 
 # Store for answer ratings (in production, use a proper database)
 answer_ratings = []
 
+async def _save_upload(file: UploadFile, file_path: str):
+    """Stream an upload to disk in 1MiB chunks
+
+    Avoids SpooledTemporaryFile's small default copy size and enforces
+    MAX_FILE_SIZE while reading, so an understated Content-Length can't
+    push an oversized body onto disk.
+    """
+    bytes_written = 0
+    try:
+        async with aiofiles.open(file_path, "wb") as buffer:
+            while chunk := await file.read(1024 * 1024):
+                bytes_written += len(chunk)
+                if bytes_written > settings.MAX_FILE_SIZE:
+                    raise HTTPException(
+                        status_code=400,
+                        detail=f"File too large. Maximum size: {settings.MAX_FILE_SIZE / (1024*1024):.1f}MB"
+                    )
+                await buffer.write(chunk)
+    except Exception:
+        if os.path.exists(file_path):
+            os.remove(file_path)
+        raise
+
 @app.get("/", response_class=HTMLResponse)
 async def read_root(request: Request):
     """Serve the main application page"""
@@ -67,21 +102,104 @@ async def upload_document(file: UploadFile = File(...)):
         
         # Save file temporarily
         file_path = os.path.join(settings.UPLOAD_DIRECTORY, file.filename)
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        await _save_upload(file, file_path)
         
-        # Process document
-        metadata = document_processor.process_document(
-            file_path, 
-            file.filename, 
-            file.content_type
+        # Process document on a worker thread; parsing and embedding are
+        # blocking work that would otherwise stall the event loop and
+        # every other in-flight request
+        metadata = await asyncio.to_thread(
+            document_processor.process_document,
+            file_path,
+            file.filename,
+            file.content_type,
+            file_size=file.size
         )
         
         # Clean up temporary file
         os.remove(file_path)
-        
+
+        # New content invalidates cached answers and their citations
+        rag_pipeline.clear_response_caches()
+
         return metadata
-        
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+def _extract_batch(saved):
+    """Run text extraction for saved files across a process pool"""
+    texts = []
+    with ProcessPoolExecutor(max_workers=settings.INGEST_WORKERS) as executor:
+        futures = [executor.submit(extract_text, path, content_type) for path, _, content_type, _ in saved]
+        for future in futures:
+            try:
+                texts.append(future.result())
+            except Exception as e:
+                texts.append(e)
+    return texts
+
+@app.post("/upload-batch", response_model=List[DocumentMetadata])
+async def upload_documents(files: List[UploadFile] = File(...)):
+    """Upload and process several documents in one request"""
+    try:
+        saved = []
+        for file in files:
+            # Validate file type
+            file_extension = os.path.splitext(file.filename)[1].lower()
+            if file_extension not in settings.ALLOWED_EXTENSIONS:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"File type {file_extension} not supported. Allowed types: {settings.ALLOWED_EXTENSIONS}"
+                )
+
+            # Validate file size
+            if file.size > settings.MAX_FILE_SIZE:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"File too large. Maximum size: {settings.MAX_FILE_SIZE / (1024*1024):.1f}MB"
+                )
+
+            file_path = os.path.join(settings.UPLOAD_DIRECTORY, file.filename)
+            await _save_upload(file, file_path)
+            saved.append((file_path, file.filename, file.content_type, file.size))
+
+        # Text extraction is CPU-bound (PDF/xlsx parsing), so fan it out
+        # across worker processes; waiting on the pool happens on a
+        # thread so the event loop stays free for other requests
+        texts = await asyncio.to_thread(_extract_batch, saved)
+
+        # Embed and store every successfully extracted file as one batch
+        # so ChromaDB syncs its WAL once instead of once per document
+        results = []
+        items = []
+        for text, (file_path, filename, content_type, file_size) in zip(texts, saved):
+            if isinstance(text, Exception):
+                results.append(DocumentMetadata(
+                    filename=filename,
+                    upload_date=datetime.now().isoformat(),
+                    file_size=0,
+                    content_type=content_type,
+                    chunk_count=0,
+                    processing_status=f"error: {str(text)}"
+                ))
+            else:
+                results.append(None)
+                items.append((file_path, filename, content_type, text, file_size))
+
+        if items:
+            processed = iter(await asyncio.to_thread(document_processor.process_documents, items))
+            results = [result if result is not None else next(processed) for result in results]
+            rag_pipeline.clear_response_caches()
+
+        for file_path, _, _, _ in saved:
+            os.remove(file_path)
+
+        return results
+
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -96,12 +214,14 @@ async def search_documents(
         if not query.strip():
             raise HTTPException(status_code=400, detail="Query cannot be empty")
         
-        response = rag_pipeline.search_and_answer(
+        # The pipeline is async: LLM calls await on the loop while the
+        # blocking embedding/retrieval work runs on worker threads
+        response = await rag_pipeline.search_and_answer(
             query=query,
             include_confidence=include_confidence,
             include_enrichment=include_enrichment
         )
-        
+
         return response
         
     except Exception as e:
@@ -114,12 +234,12 @@ async def search_documents_json(search_query: SearchQuery):
         if not search_query.query.strip():
             raise HTTPException(status_code=400, detail="Query cannot be empty")
         
-        response = rag_pipeline.search_and_answer(
+        response = await rag_pipeline.search_and_answer(
             query=search_query.query,
             include_confidence=search_query.include_confidence,
             include_enrichment=search_query.include_enrichment
         )
-        
+
         return response
         
     except Exception as e:
@@ -144,6 +264,8 @@ async def delete_document(filename: str):
         
         success = document_processor.delete_document(decoded_filename)
         if success:
+            # Cached answers may cite the deleted document
+            rag_pipeline.clear_response_caches()
             return {"message": f"Document '{decoded_filename}' deleted successfully"}
         else:
             raise HTTPException(status_code=404, detail="Document not found")
@@ -1,47 +1,41 @@
-import json
+import asyncio
+import bisect
+import hashlib
 import time
+from collections import OrderedDict
+from dataclasses import dataclass
 from typing import List, Dict, Any, Optional
-from openai import OpenAI
-from langchain.prompts import PromptTemplate
-from langchain.schema import BaseOutputParser
+
+import httpx
+import numpy as np
+import orjson
+from openai import AsyncOpenAI
 from pydantic import BaseModel, Field
 
 from config import settings
 from models import SearchResponse, MissingInfo, MissingInfoType, EnrichmentSuggestion, ConfidenceLevel
 from document_processor import DocumentProcessor
 
-class StructuredOutputParser(BaseOutputParser):
-    """Parse structured JSON output from LLM"""
-    
-    def parse(self, text: str) -> Dict[str, Any]:
-        try:
-            # Extract JSON from the text (in case there's extra text)
-            start_idx = text.find('{')
-            end_idx = text.rfind('}') + 1
-            if start_idx != -1 and end_idx != 0:
-                json_str = text[start_idx:end_idx]
-                return json.loads(json_str)
-            else:
-                raise ValueError("No JSON found in response")
-        except json.JSONDecodeError as e:
-            # Fallback parsing
-            return {
-                "answer": text,
-                "confidence": 0.5,
-                "missing_info": [],
-                "enrichment_suggestions": []
-            }
+# Tokenizer for budgeting prompt context; fall back to a rough
+# chars-per-token estimate if tiktoken doesn't know the model
+try:
+    import tiktoken
+    try:
+        _ENC = tiktoken.encoding_for_model(settings.LLM_MODEL)
+    except KeyError:
+        _ENC = tiktoken.get_encoding("cl100k_base")
+except ImportError:
+    _ENC = None
 
-class RAGPipeline:
-    def __init__(self):
-        self.document_processor = DocumentProcessor()
-        self.openai_client = OpenAI(api_key=settings.OPENAI_API_KEY)
-        self.output_parser = StructuredOutputParser()
-        
-        # Define prompts
-        self.rag_prompt = PromptTemplate(
-            input_variables=["context", "question"],
-            template="""You are an AI assistant that answers questions based on the provided context documents. 
+def _count_tokens(text: str) -> int:
+    if _ENC is not None:
+        return len(_ENC.encode(text))
+    return len(text) // 4
+
+# Prompt templates are plain strings split once on their placeholders at
+# startup; per-request assembly is then a single join of literal parts
+# with the dynamic values, with no template-substitution pass
+_RAG_TEMPLATE = """You are an AI assistant that answers questions based on the provided context documents.
             Analyze the context and provide a comprehensive answer to the user's question.
 
             Context Documents:
@@ -50,27 +44,27 @@ class RAGPipeline:
             Question: {question}
 
             Please provide your response in the following JSON format:
-            {{
+            {
                 "answer": "Your detailed answer based on the context",
                 "confidence": 0.85,
                 "missing_info": [
-                    {{
+                    {
                         "type": "document|data|context|specific_fact",
                         "description": "What specific information is missing",
                         "suggested_action": "What action should be taken to get this information",
                         "priority": 1-5
-                    }}
+                    }
                 ],
                 "enrichment_suggestions": [
-                    {{
+                    {
                         "type": "document_type",
                         "description": "What kind of document would help",
                         "action": "Specific action to take",
                         "confidence": 0.8,
                         "estimated_effort": "low|medium|high"
-                    }}
+                    }
                 ]
-            }}
+            }
 
             Guidelines:
             1. If the context contains sufficient information, provide a confident answer (confidence > 0.7)
@@ -80,18 +74,15 @@ class RAGPipeline:
             5. For enrichment_suggestions, provide actionable recommendations
             6. Always base your answer primarily on the provided context
             """
-        )
-        
-        self.completeness_prompt = PromptTemplate(
-            input_variables=["answer", "question", "context"],
-            template="""Analyze the completeness of this answer in relation to the question and available context.
+
+_COMPLETENESS_TEMPLATE = """Analyze the completeness of this answer in relation to the question and available context.
 
             Question: {question}
             Answer: {answer}
             Available Context: {context}
 
             Rate the completeness and identify specific gaps. Respond in JSON format:
-            {{
+            {
                 "completeness_score": 0.85,
                 "missing_aspects": [
                     "Specific aspect that's missing",
@@ -103,64 +94,338 @@ class RAGPipeline:
                 "suggested_improvements": [
                     "How to improve the answer"
                 ]
-            }}
+            }
             """
+
+_COMBINED_TEMPLATE = """You are an AI assistant that answers questions based on the provided context documents.
+            Analyze the context, provide a comprehensive answer to the user's question, and then
+            critique your own answer's completeness against the same context.
+
+            Context Documents:
+            {context}
+
+            Question: {question}
+
+            Please provide your response in the following JSON format:
+            {
+                "answer_block": {
+                    "answer": "Your detailed answer based on the context",
+                    "confidence": 0.85,
+                    "missing_info": [
+                        {
+                            "type": "document|data|context|specific_fact",
+                            "description": "What specific information is missing",
+                            "suggested_action": "What action should be taken to get this information",
+                            "priority": 1-5
+                        }
+                    ],
+                    "enrichment_suggestions": [
+                        {
+                            "type": "document_type",
+                            "description": "What kind of document would help",
+                            "action": "Specific action to take",
+                            "confidence": 0.8,
+                            "estimated_effort": "low|medium|high"
+                        }
+                    ]
+                },
+                "completeness_block": {
+                    "completeness_score": 0.85,
+                    "missing_aspects": [
+                        "Specific aspect that's missing"
+                    ],
+                    "confidence_issues": [
+                        "Areas where the answer is uncertain"
+                    ],
+                    "suggested_improvements": [
+                        "How to improve the answer"
+                    ]
+                }
+            }
+
+            Guidelines:
+            1. If the context contains sufficient information, provide a confident answer (confidence > 0.7)
+            2. If information is partially available, provide what you can and flag missing parts (confidence 0.4-0.7)
+            3. If very little relevant information is available, be honest about limitations (confidence < 0.4)
+            4. For missing_info, be specific about what's missing and why it's important
+            5. For enrichment_suggestions, provide actionable recommendations
+            6. Always base your answer primarily on the provided context
+            7. Critique the answer honestly in completeness_block; do not inflate the score
+            """
+
+def _split_template(template: str, placeholders: List[str]) -> List[str]:
+    """Split a template into the literal parts around its placeholders"""
+    parts = []
+    rest = template
+    for placeholder in placeholders:
+        literal, rest = rest.split("{" + placeholder + "}", 1)
+        parts.append(literal)
+    parts.append(rest)
+    return parts
+
+# Internal records for missing-info / enrichment items. Slotted
+# dataclasses keep field access attribute-based (no per-read hashing or
+# .get defaults) and are lighter than dicts; conversion to the pydantic
+# response models happens only at the response boundary.
+@dataclass(slots=True)
+class _MissingInfoRec:
+    type: str = "context"
+    description: str = ""
+    suggested_action: str = ""
+    priority: int = 3
+
+@dataclass(slots=True)
+class _SuggestionRec:
+    type: str = ""
+    description: str = ""
+    action: str = ""
+    confidence: float = 0.5
+    estimated_effort: str = "medium"
+
+def _normalize_answer_data(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Convert the LLM's raw missing-info/suggestion dicts to records"""
+    data["missing_info"] = [
+        _MissingInfoRec(
+            type=info.get("type", "context"),
+            description=info.get("description", ""),
+            suggested_action=info.get("suggested_action", ""),
+            priority=info.get("priority", 3)
+        )
+        for info in data.get("missing_info", []) if isinstance(info, dict)
+    ]
+    data["enrichment_suggestions"] = [
+        _SuggestionRec(
+            type=suggestion.get("type", ""),
+            description=suggestion.get("description", ""),
+            action=suggestion.get("action", ""),
+            confidence=suggestion.get("confidence", 0.5),
+            estimated_effort=suggestion.get("estimated_effort", "medium")
         )
+        for suggestion in data.get("enrichment_suggestions", []) if isinstance(suggestion, dict)
+    ]
+    return data
 
-    def search_and_answer(self, query: str, include_confidence: bool = True, include_enrichment: bool = True) -> SearchResponse:
+def _parse_llm_json(text: str) -> Dict[str, Any]:
+    """Parse an LLM response produced in JSON mode
+
+    With response_format=json_object the model returns bare JSON, so no
+    brace-scanning over the text is needed; the fallback only guards
+    against transport-level surprises. orjson decodes the multi-KB
+    payloads a few times faster than stdlib json.
+    """
+    try:
+        return orjson.loads(text)
+    except (orjson.JSONDecodeError, TypeError):
+        return {
+            "answer": text,
+            "confidence": 0.5,
+            "missing_info": [],
+            "enrichment_suggestions": []
+        }
+
+class RAGPipeline:
+    # Query classification is one tokenization plus set intersections
+    # against these frozen keyword sets; whole-token matching keeps
+    # e.g. "is" from firing inside "history". Suggestion templates are
+    # built once at class level.
+    _QTYPE_WORDS = (
+        ("proc", frozenset({"how", "process", "steps", "procedure"})),
+        ("ref", frozenset({"what", "definition", "meaning", "is"})),
+        ("time", frozenset({"when", "date", "time", "schedule"})),
+    )
+    _TOKEN_PUNCT = ".,!?;:\"'()"
+
+    _QTYPE_SUGGESTIONS = {
+        "proc": _SuggestionRec(
+            type="procedure_document",
+            description="Step-by-step procedure or manual",
+            action="Upload procedure documents, user manuals, or process guides",
+            confidence=0.8,
+            estimated_effort="medium"
+        ),
+        "ref": _SuggestionRec(
+            type="reference_document",
+            description="Glossary, definitions, or reference material",
+            action="Upload reference documents, glossaries, or specification sheets",
+            confidence=0.7,
+            estimated_effort="low"
+        ),
+        "time": _SuggestionRec(
+            type="temporal_document",
+            description="Timeline, schedule, or date-specific information",
+            action="Upload schedules, timelines, or historical records",
+            confidence=0.8,
+            estimated_effort="medium"
+        )
+    }
+
+    def __init__(self):
+        self.document_processor = DocumentProcessor()
+        # One long-lived HTTP/2 client with a generous keep-alive pool:
+        # the back-to-back LLM calls per request (and concurrent
+        # requests under load) reuse warm connections instead of paying
+        # a TLS handshake each time
+        self.openai_client = AsyncOpenAI(
+            api_key=settings.OPENAI_API_KEY,
+            http_client=httpx.AsyncClient(
+                http2=True,
+                limits=httpx.Limits(max_connections=100, max_keepalive_connections=50),
+                timeout=httpx.Timeout(60.0, connect=5.0)
+            )
+        )
+
+        # Semantic query cache: (query, flags) -> (unit embedding,
+        # response, expiry). Rephrasings whose embeddings clear the
+        # cosine threshold — under the same confidence/enrichment flags
+        # — reuse the whole pipeline result instead of paying retrieval
+        # plus two LLM calls again.
+        self._semantic_cache: OrderedDict = OrderedDict()
+
+        # Exact response cache: request hash -> (serialized response
+        # bytes, expiry). Exact repeats (UI retries, shared links)
+        # replay the stored payload without even embedding the query;
+        # the fuzzy semantic cache above handles rephrasings. Shares
+        # the semantic cache's TTL so it can't outlive that bound, and
+        # both caches are cleared when documents change.
+        self._exact_cache: OrderedDict = OrderedDict()
+
+        # Pre-split the prompt templates around their placeholders so
+        # per-request assembly is a single string join
+        self._rag_parts = _split_template(_RAG_TEMPLATE, ["context", "question"])
+        self._completeness_parts = _split_template(_COMPLETENESS_TEMPLATE, ["question", "answer", "context"])
+        self._combined_parts = _split_template(_COMBINED_TEMPLATE, ["context", "question"])
+
+        # Sorted thresholds for bisect-based confidence-level mapping;
+        # adding levels later only means extending these two lists
+        self._threshold_values = [settings.MEDIUM_CONFIDENCE_THRESHOLD, settings.HIGH_CONFIDENCE_THRESHOLD]
+        self._threshold_levels = [ConfidenceLevel.LOW, ConfidenceLevel.MEDIUM, ConfidenceLevel.HIGH]
+
+    async def search_and_answer(self, query: str, include_confidence: bool = True, include_enrichment: bool = True) -> SearchResponse:
         """Main RAG pipeline: search, retrieve, and generate answer with completeness analysis"""
         start_time = time.time()
-        
+
         try:
-            # Step 1: Search for relevant documents
-            search_results = self.document_processor.search_documents(query)
-            
+            # Exact-repeat lookup first: an O(1) dict hit replays the
+            # serialized response without touching the embedding model
+            cache_key = hashlib.sha1(
+                f"{query}|{settings.LLM_MODEL}|{include_confidence}|{include_enrichment}".encode()
+            ).hexdigest()
+            entry = self._exact_cache.get(cache_key)
+            if entry is not None:
+                cached_bytes, expiry = entry
+                if expiry > time.time():
+                    self._exact_cache.move_to_end(cache_key)
+                    return SearchResponse.parse_raw(cached_bytes).copy(
+                        update={"processing_time": time.time() - start_time}
+                    )
+                del self._exact_cache[cache_key]
+
+            # Step 0: Semantic cache lookup on the query embedding.
+            # The flag pair is part of the match: a response built
+            # without enrichment must not answer a request that asked
+            # for it (and vice versa), however close the embeddings.
+            flags = (include_confidence, include_enrichment)
+            query_vec = await asyncio.to_thread(self.document_processor.embed_query, query)
+            norm = np.linalg.norm(query_vec)
+            if norm > 0:
+                query_vec = query_vec / norm
+            cached = self._semantic_cache_get(query_vec, flags)
+            if cached is not None:
+                return cached.copy(update={"processing_time": time.time() - start_time})
+
+            # Step 1: Search for relevant documents (embedding + Chroma
+            # are blocking, so keep them off the event loop)
+            search_results = await asyncio.to_thread(self.document_processor.search_documents, query)
+
             if not search_results:
                 return self._create_empty_response(query, start_time)
-            
-            # Step 2: Prepare context from search results
-            context = self._prepare_context(search_results)
-            
-            # Step 3: Generate answer using LLM
-            answer_data = self._generate_structured_answer(query, context)
-            
-            # Step 4: Analyze completeness if requested
+
+            # Step 2: Prepare context from search results (token
+            # counting over all retrieved chunks is CPU-bound)
+            context = await asyncio.to_thread(self._prepare_context, search_results)
+
+            # Step 3: Generate answer using LLM. When the completeness
+            # critique is wanted anyway, request both blocks in one call
+            # (same context prefill, one round-trip); otherwise just the
+            # answer.
+            completeness_data = None
             if include_confidence or include_enrichment:
-                completeness_data = self._analyze_completeness(
-                    answer_data.get("answer", ""), 
-                    query, 
-                    context
-                )
-                
-                # Merge completeness analysis with answer data
-                answer_data = self._merge_completeness_data(answer_data, completeness_data)
-            
-            # Step 5: Generate enrichment suggestions if requested
+                answer_data, completeness_data = await self._generate_answer_with_completeness(query, context)
+            else:
+                answer_data = await self._generate_structured_answer(query, context)
+
+            # Error-fallback answers must not be cached: a transient
+            # LLM failure would otherwise be replayed to every retry
+            # (and rephrasing) for the full TTL
+            degraded = answer_data.pop("degraded", False)
+
+            # Steps 4+5: If the combined call didn't yield a usable
+            # critique, fall back to the separate completeness call
+            # (concurrently with the heuristic enrichment suggestions)
+            completeness_task = None
+            enrichment_task = None
+            if (include_confidence or include_enrichment) and completeness_data is None:
+                if self._can_skip_completeness(answer_data, query, search_results):
+                    # Easy-query tail: trust the answer's own confidence
+                    # instead of paying another LLM round-trip
+                    completeness_data = {
+                        "completeness_score": answer_data.get("confidence", 0.5),
+                        "missing_aspects": [],
+                        "confidence_issues": [],
+                        "suggested_improvements": []
+                    }
+                else:
+                    completeness_task = asyncio.create_task(self._analyze_completeness(
+                        answer_data.get("answer", ""),
+                        query,
+                        context
+                    ))
             if include_enrichment:
-                enrichment_suggestions = self._generate_enrichment_suggestions(
+                enrichment_task = asyncio.create_task(asyncio.to_thread(
+                    self._generate_enrichment_suggestions,
                     answer_data.get("missing_info", []),
                     query,
                     search_results
-                )
-                answer_data["enrichment_suggestions"] = enrichment_suggestions
-            
+                ))
+
+            if completeness_task is not None:
+                completeness_data = await completeness_task
+            if completeness_data is not None:
+                answer_data = self._merge_completeness_data(answer_data, completeness_data)
+            if enrichment_task is not None:
+                answer_data["enrichment_suggestions"] = await enrichment_task
+
             # Step 6: Determine confidence level
             confidence = answer_data.get("confidence", 0.5)
             confidence_level = self._determine_confidence_level(confidence)
             
-            # Step 7: Format response
+            # Step 7: Format response (string/model building happens on
+            # a worker thread so it can't stall other coroutines)
+            sources, missing_info, enrichment_suggestions = await asyncio.to_thread(
+                self._format_response_parts, search_results, answer_data
+            )
             processing_time = time.time() - start_time
-            
-            return SearchResponse(
+
+            response = SearchResponse(
                 answer=answer_data.get("answer", "I couldn't generate a proper answer."),
                 confidence=confidence,
                 confidence_level=confidence_level,
-                sources=self._format_sources(search_results),
-                missing_info=self._format_missing_info(answer_data.get("missing_info", [])),
-                enrichment_suggestions=self._format_enrichment_suggestions(answer_data.get("enrichment_suggestions", [])),
+                sources=sources,
+                missing_info=missing_info,
+                enrichment_suggestions=enrichment_suggestions,
                 processing_time=processing_time
             )
-            
+
+            if not degraded:
+                self._semantic_cache_put(query, flags, query_vec, response)
+                self._exact_cache[cache_key] = (
+                    orjson.dumps(response.dict()),
+                    time.time() + settings.SEMANTIC_CACHE_TTL
+                )
+                while len(self._exact_cache) > settings.EXACT_CACHE_SIZE:
+                    self._exact_cache.popitem(last=False)
+            return response
+
         except Exception as e:
             processing_time = time.time() - start_time
             return SearchResponse(
@@ -173,59 +438,204 @@ class RAGPipeline:
                 processing_time=processing_time
             )
 
+    def _can_skip_completeness(self, answer_data: Dict[str, Any], query: str, search_results: List[Dict[str, Any]]) -> bool:
+        """Decide whether the completeness LLM call can be skipped
+
+        High-confidence answers backed by uniformly strong retrieval
+        matches, and very short queries, gain little from a second
+        critique pass, so skip it for that tail of traffic.
+        """
+        confidence = answer_data.get("confidence", 0.0)
+        if (confidence >= settings.HIGH_CONFIDENCE_THRESHOLD
+                and min(result["similarity_score"] for result in search_results) >= settings.COMPLETENESS_BYPASS_SIMILARITY):
+            return True
+        return len(query.split()) < settings.COMPLETENESS_BYPASS_QUERY_WORDS
+
+    def _semantic_cache_get(self, query_vec: np.ndarray, flags: tuple) -> Optional[SearchResponse]:
+        """Return a cached response whose query embedding is close enough
+
+        Only entries built under the same (include_confidence,
+        include_enrichment) pair are candidates; entries are keyed by
+        (query, flags) so the same query can coexist per flag combo.
+        """
+        now = time.time()
+        for key in [k for k, (_, _, expiry) in self._semantic_cache.items() if expiry <= now]:
+            del self._semantic_cache[key]
+
+        candidates = [
+            (key, entry[0])
+            for key, entry in self._semantic_cache.items()
+            if key[1] == flags
+        ]
+        if not candidates:
+            return None
+
+        # Equivalent of a flat inner-product index: one matrix-vector
+        # product over the (small) set of cached unit embeddings
+        keys = [key for key, _ in candidates]
+        matrix = np.stack([vec for _, vec in candidates])
+        scores = matrix @ query_vec
+        best = int(np.argmax(scores))
+        if scores[best] >= settings.SEMANTIC_CACHE_THRESHOLD:
+            key = keys[best]
+            self._semantic_cache.move_to_end(key)
+            return self._semantic_cache[key][1]
+        return None
+
+    def _semantic_cache_put(self, query: str, flags: tuple, query_vec: np.ndarray, response: SearchResponse):
+        """Cache a pipeline result under its unit query embedding"""
+        key = (query, flags)
+        self._semantic_cache[key] = (query_vec, response, time.time() + settings.SEMANTIC_CACHE_TTL)
+        self._semantic_cache.move_to_end(key)
+        while len(self._semantic_cache) > settings.SEMANTIC_CACHE_SIZE:
+            self._semantic_cache.popitem(last=False)
+
+    def clear_response_caches(self):
+        """Drop all cached responses after the document set changes
+
+        Uploads and deletes change what retrieval can return, so cached
+        answers (and their source citations) would otherwise keep
+        replaying the old corpus until their TTLs lapse or LRU eviction
+        catches up.
+        """
+        self._exact_cache.clear()
+        self._semantic_cache.clear()
+
+    def search_and_answer_sync(self, query: str, include_confidence: bool = True, include_enrichment: bool = True) -> SearchResponse:
+        """Synchronous wrapper for callers without a running event loop"""
+        return asyncio.run(self.search_and_answer(
+            query,
+            include_confidence=include_confidence,
+            include_enrichment=include_enrichment
+        ))
+
     def _prepare_context(self, search_results: List[Dict[str, Any]]) -> str:
-        """Prepare context string from search results"""
-        context_parts = []
-        for i, result in enumerate(search_results, 1):
-            context_parts.append(
-                f"Document {i} (Source: {result['metadata']['filename']}, "
-                f"Similarity: {result['similarity_score']:.2f}):\n"
-                f"{result['content']}\n"
-            )
-        return "\n".join(context_parts)
+        """Prepare context string from search results, capped to a token budget
 
-    def _generate_structured_answer(self, query: str, context: str) -> Dict[str, Any]:
+        Prefill cost (and time-to-first-token) scales with context
+        length, so keep the highest-similarity chunks and drop the tail
+        once MAX_CONTEXT_TOKENS is reached. At least one chunk is always
+        included.
+        """
+        remaining = settings.MAX_CONTEXT_TOKENS
+        included = []
+        for result in sorted(search_results, key=lambda r: r["similarity_score"], reverse=True):
+            cost = _count_tokens(result["content"])
+            if included and cost > remaining:
+                break
+            remaining -= cost
+            included.append(result)
+
+        # One f-string per result over a generator; the source label is
+        # prebuilt at ingest time (fall back for chunks indexed before
+        # that field existed)
+        return "\n\n".join(
+            f"Document {i} ({result['metadata'].get('source_label') or 'Source: ' + result['metadata']['filename']}, "
+            f"Similarity: {result['similarity_score']:.2f}):\n{result['content']}"
+            for i, result in enumerate(included, 1)
+        )
+
+    async def _generate_structured_answer(self, query: str, context: str) -> Dict[str, Any]:
         """Generate structured answer using LLM"""
         try:
-            prompt = self.rag_prompt.format(context=context, question=query)
-            
-            response = self.openai_client.chat.completions.create(
+            pre, mid, suf = self._rag_parts
+            prompt = "".join((pre, context, mid, query, suf))
+
+            # Stream the completion so network transfer overlaps token
+            # generation; deltas accumulate in a list (never += on a
+            # string) and are joined and parsed exactly once at the end
+            stream = await self.openai_client.chat.completions.create(
                 model=settings.LLM_MODEL,
                 messages=[{"role": "user", "content": prompt}],
                 temperature=settings.LLM_TEMPERATURE,
-                max_tokens=2000
+                max_tokens=2000,
+                response_format={"type": "json_object"},
+                stream=True
             )
-            
-            answer_text = response.choices[0].message.content
-            return self.output_parser.parse(answer_text)
+
+            chunks = []
+            async for event in stream:
+                if event.choices and event.choices[0].delta.content:
+                    chunks.append(event.choices[0].delta.content)
+
+            return _normalize_answer_data(_parse_llm_json("".join(chunks)))
             
         except Exception as e:
-            # Fallback to simple answer generation
+            # Fallback to simple answer generation; degraded marks the
+            # answer as uncacheable so a retry gets a fresh attempt
             return {
                 "answer": f"Based on the available documents, I found some relevant information, but encountered an error processing the structured response: {str(e)}",
                 "confidence": 0.3,
                 "missing_info": [],
-                "enrichment_suggestions": []
+                "enrichment_suggestions": [],
+                "degraded": True
             }
 
-    def _analyze_completeness(self, answer: str, query: str, context: str) -> Dict[str, Any]:
-        """Analyze the completeness of the answer"""
+    async def _generate_answer_with_completeness(self, query: str, context: str) -> tuple:
+        """Generate the answer and its completeness critique in one call
+
+        Both blocks share one context prefill and one network round-trip
+        instead of two sequential LLM requests. Returns (answer_data,
+        completeness_data); completeness_data is None when the model
+        ignored the two-block shape, in which case the caller falls back
+        to the separate completeness call.
+        """
         try:
-            prompt = self.completeness_prompt.format(
-                answer=answer,
-                question=query,
-                context=context
+            pre, mid, suf = self._combined_parts
+            prompt = "".join((pre, context, mid, query, suf))
+
+            stream = await self.openai_client.chat.completions.create(
+                model=settings.LLM_MODEL,
+                messages=[{"role": "user", "content": prompt}],
+                temperature=settings.LLM_TEMPERATURE,
+                max_tokens=3000,
+                response_format={"type": "json_object"},
+                stream=True
             )
-            
-            response = self.openai_client.chat.completions.create(
+
+            chunks = []
+            async for event in stream:
+                if event.choices and event.choices[0].delta.content:
+                    chunks.append(event.choices[0].delta.content)
+
+            data = _parse_llm_json("".join(chunks))
+
+        except Exception as e:
+            return {
+                "answer": f"Based on the available documents, I found some relevant information, but encountered an error processing the structured response: {str(e)}",
+                "confidence": 0.3,
+                "missing_info": [],
+                "enrichment_suggestions": [],
+                "degraded": True
+            }, None
+
+        answer_block = data.get("answer_block")
+        if not isinstance(answer_block, dict):
+            # Model ignored the two-block shape; treat the payload as a
+            # bare answer and let the caller fetch completeness itself
+            answer_block = data
+        completeness_block = data.get("completeness_block")
+        if not isinstance(completeness_block, dict):
+            completeness_block = None
+
+        return _normalize_answer_data(answer_block), completeness_block
+
+    async def _analyze_completeness(self, answer: str, query: str, context: str) -> Dict[str, Any]:
+        """Analyze the completeness of the answer"""
+        try:
+            p0, p1, p2, p3 = self._completeness_parts
+            prompt = "".join((p0, query, p1, answer, p2, context, p3))
+
+            response = await self.openai_client.chat.completions.create(
                 model=settings.LLM_MODEL,
                 messages=[{"role": "user", "content": prompt}],
                 temperature=0.1,
-                max_tokens=1000
+                max_tokens=1000,
+                response_format={"type": "json_object"}
             )
-            
+
             completeness_text = response.choices[0].message.content
-            return self.output_parser.parse(completeness_text)
+            return _parse_llm_json(completeness_text)
             
         except Exception as e:
             return {
@@ -250,116 +660,105 @@ class RAGPipeline:
         for aspect in missing_aspects:
             if "missing_info" not in answer_data:
                 answer_data["missing_info"] = []
-            
-            answer_data["missing_info"].append({
-                "type": "context",
-                "description": aspect,
-                "suggested_action": f"Find additional documents that cover: {aspect}",
-                "priority": 3
-            })
-        
+
+            answer_data["missing_info"].append(_MissingInfoRec(
+                type="context",
+                description=aspect,
+                suggested_action=f"Find additional documents that cover: {aspect}",
+                priority=3
+            ))
+
         return answer_data
 
-    def _generate_enrichment_suggestions(self, missing_info: List[Dict], query: str, search_results: List[Dict]) -> List[Dict]:
+    def _generate_enrichment_suggestions(self, missing_info: List[_MissingInfoRec], query: str, search_results: List[Dict]) -> List[_SuggestionRec]:
         """Generate enrichment suggestions based on missing information and query"""
         suggestions = []
-        
-        # Analyze query type to suggest document types
-        query_lower = query.lower()
-        
-        if any(word in query_lower for word in ["how", "process", "steps", "procedure"]):
-            suggestions.append({
-                "type": "procedure_document",
-                "description": "Step-by-step procedure or manual",
-                "action": "Upload procedure documents, user manuals, or process guides",
-                "confidence": 0.8,
-                "estimated_effort": "medium"
-            })
-        
-        if any(word in query_lower for word in ["what", "definition", "meaning", "is"]):
-            suggestions.append({
-                "type": "reference_document",
-                "description": "Glossary, definitions, or reference material",
-                "action": "Upload reference documents, glossaries, or specification sheets",
-                "confidence": 0.7,
-                "estimated_effort": "low"
-            })
-        
-        if any(word in query_lower for word in ["when", "date", "time", "schedule"]):
-            suggestions.append({
-                "type": "temporal_document",
-                "description": "Timeline, schedule, or date-specific information",
-                "action": "Upload schedules, timelines, or historical records",
-                "confidence": 0.8,
-                "estimated_effort": "medium"
-            })
-        
+
+        # Analyze query type to suggest document types: tokenize once,
+        # then each class check is a constant-ish set intersection
+        tokens = frozenset(word.strip(self._TOKEN_PUNCT) for word in query.lower().split())
+        suggestions.extend(
+            self._QTYPE_SUGGESTIONS[qtype]
+            for qtype, words in self._QTYPE_WORDS
+            if words & tokens
+        )
+
+
         # Add suggestions based on missing info
         for info in missing_info:
-            if info.get("type") == "specific_fact":
-                suggestions.append({
-                    "type": "factual_document",
-                    "description": f"Document containing: {info.get('description', 'specific facts')}",
-                    "action": info.get("suggested_action", "Find relevant documents"),
-                    "confidence": 0.6,
-                    "estimated_effort": "high"
-                })
-        
+            if info.type == "specific_fact":
+                suggestions.append(_SuggestionRec(
+                    type="factual_document",
+                    description=f"Document containing: {info.description or 'specific facts'}",
+                    action=info.suggested_action or "Find relevant documents",
+                    confidence=0.6,
+                    estimated_effort="high"
+                ))
+
         # Remove duplicates and limit to top 5
         unique_suggestions = []
         seen_types = set()
         for suggestion in suggestions:
-            if suggestion["type"] not in seen_types:
+            if suggestion.type not in seen_types:
                 unique_suggestions.append(suggestion)
-                seen_types.add(suggestion["type"])
-        
+                seen_types.add(suggestion.type)
+
         return unique_suggestions[:5]
 
     def _determine_confidence_level(self, confidence: float) -> ConfidenceLevel:
         """Determine confidence level based on confidence score"""
-        if confidence >= settings.HIGH_CONFIDENCE_THRESHOLD:
-            return ConfidenceLevel.HIGH
-        elif confidence >= settings.MEDIUM_CONFIDENCE_THRESHOLD:
-            return ConfidenceLevel.MEDIUM
-        else:
-            return ConfidenceLevel.LOW
+        # bisect_right keeps the >= threshold semantics at the exact
+        # boundary values
+        return self._threshold_levels[bisect.bisect_right(self._threshold_values, confidence)]
+
+    def _format_response_parts(self, search_results: List[Dict[str, Any]], answer_data: Dict[str, Any]) -> tuple:
+        """Build the formatted response fields in one worker-thread hop"""
+        return (
+            self._format_sources(search_results),
+            self._format_missing_info(answer_data.get("missing_info", [])),
+            self._format_enrichment_suggestions(answer_data.get("enrichment_suggestions", []))
+        )
 
     def _format_sources(self, search_results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         """Format sources for response"""
-        sources = []
-        for result in search_results:
-            sources.append({
+        # Previews are precomputed at ingest; slicing here only happens
+        # for chunks indexed before that field existed
+        return [
+            {
                 "filename": result["metadata"]["filename"],
                 "similarity_score": result["similarity_score"],
                 "chunk_index": result["metadata"]["chunk_index"],
-                "content_preview": result["content"][:200] + "..." if len(result["content"]) > 200 else result["content"]
-            })
-        return sources
+                "content_preview": result["metadata"].get("preview") or (
+                    result["content"][:200] + "..." if len(result["content"]) > 200 else result["content"]
+                )
+            }
+            for result in search_results
+        ]
 
-    def _format_missing_info(self, missing_info: List[Dict]) -> List[MissingInfo]:
-        """Format missing info for response"""
-        formatted = []
-        for info in missing_info:
-            formatted.append(MissingInfo(
-                type=MissingInfoType(info.get("type", "context")),
-                description=info.get("description", ""),
-                suggested_action=info.get("suggested_action", ""),
-                priority=info.get("priority", 3)
-            ))
-        return formatted
+    def _format_missing_info(self, missing_info: List[_MissingInfoRec]) -> List[MissingInfo]:
+        """Format missing info records for response"""
+        return [
+            MissingInfo(
+                type=MissingInfoType(info.type),
+                description=info.description,
+                suggested_action=info.suggested_action,
+                priority=info.priority
+            )
+            for info in missing_info
+        ]
 
-    def _format_enrichment_suggestions(self, suggestions: List[Dict]) -> List[EnrichmentSuggestion]:
-        """Format enrichment suggestions for response"""
-        formatted = []
-        for suggestion in suggestions:
-            formatted.append(EnrichmentSuggestion(
-                type=suggestion.get("type", ""),
-                description=suggestion.get("description", ""),
-                action=suggestion.get("action", ""),
-                confidence=suggestion.get("confidence", 0.5),
-                estimated_effort=suggestion.get("estimated_effort", "medium")
-            ))
-        return formatted
+    def _format_enrichment_suggestions(self, suggestions: List[_SuggestionRec]) -> List[EnrichmentSuggestion]:
+        """Format enrichment suggestion records for response"""
+        return [
+            EnrichmentSuggestion(
+                type=suggestion.type,
+                description=suggestion.description,
+                action=suggestion.action,
+                confidence=suggestion.confidence,
+                estimated_effort=suggestion.estimated_effort
+            )
+            for suggestion in suggestions
+        ]
 
     def _create_empty_response(self, query: str, start_time: float) -> SearchResponse:
         """Create response when no documents are found"""